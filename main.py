@@ -1,14 +1,29 @@
-from fastapi import FastAPI, Request, UploadFile, File, Form
-from fastapi.responses import HTMLResponse, PlainTextResponse, Response, JSONResponse
+from fastapi import FastAPI, Request, UploadFile, File, Form, Query
+from fastapi.responses import HTMLResponse, PlainTextResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, HttpUrl
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, TypeAdapter, field_validator, ValidationError
+from markupsafe import escape
+from typing import List, Optional, Dict, Any, Iterator, Deque, Tuple
+from collections import deque
+from itertools import islice
+from dataclasses import dataclass, field
 import io
 import csv
-import json
+import re
+import sys
+import threading
+import time
+import orjson
 
-app = FastAPI(title="InsideSuccess Link Ingestor")
+
+class ORJSONResponse(JSONResponse):
+    # orjson-backed JSON responses (FastAPI's bundled ORJSONResponse is deprecated)
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+app = FastAPI(title="InsideSuccess Link Ingestor", default_response_class=ORJSONResponse)
 
 # ✅ CORS FIX: allow OrangeMonkey (running in browser) to POST to Cloud Run
 app.add_middleware(
@@ -21,15 +36,71 @@ app.add_middleware(
 
 # -------- In-memory store (note: not persistent) --------
 MAX_INGESTS = 50
-INGESTS: List[Dict[str, Any]] = []  # each item: {received_at, platform, source, page, startDate, endDate, count, items}
+UPLOAD_INLINE_PARSE_BYTES = 256 * 1024  # larger uploads are parsed in the threadpool
+CSV_CHUNK_ROWS = 500  # rows per streamed chunk of /download/latest.csv
+
+
+@dataclass(slots=True)
+class IngestRecord:
+    received_at: str
+    source: str
+    page: str
+    platform: str
+    startDate: str
+    endDate: str
+    count: int
+    client: Optional[str] = None
+    row_html: str = field(default="", repr=False)  # cached dashboard cells, filled by push_ingest
+
+    def to_dict(self) -> Dict[str, Any]:
+        # public JSON shape (no cached HTML)
+        return {
+            "received_at": self.received_at,
+            "source": self.source,
+            "page": self.page,
+            "platform": self.platform,
+            "startDate": self.startDate,
+            "endDate": self.endDate,
+            "count": self.count,
+            "client": self.client,
+        }
+
+
+# only summaries are kept per ingest; the full item list is held for the most recent one alone
+# (that is all /download/latest.csv needs), so memory no longer scales with MAX_INGESTS x items
+INGESTS: Deque[IngestRecord] = deque(maxlen=MAX_INGESTS)  # newest first
+LATEST_ITEMS: List[Dict[str, Any]] = []
+STORE_LOCK = threading.Lock()  # keeps INGESTS[0] and LATEST_ITEMS from the same ingest
+
+
+URL_RE = re.compile(r"https?://\S+", re.IGNORECASE)
 
 
 class Item(BaseModel):
     platform: str
     dateISO: Optional[str] = None
-    url: HttpUrl
+    url: str  # stored and re-emitted as-is, so a cheap shape check instead of HttpUrl parsing
     text: Optional[str] = None  # preview/caption line
 
+    @field_validator("platform")
+    @classmethod
+    def _intern_platform(cls, v: str) -> str:
+        # only a handful of platform names, repeated on every item; share one str object each
+        return sys.intern(v)
+
+    @field_validator("dateISO")
+    @classmethod
+    def _intern_empty_date(cls, v: Optional[str]) -> Optional[str]:
+        # dates are per post, so only the common empty value is worth sharing
+        return sys.intern(v) if v == "" else v
+
+    @field_validator("url")
+    @classmethod
+    def _check_url(cls, v: str) -> str:
+        if not URL_RE.fullmatch(v):
+            raise ValueError("url must be an http(s) URL")
+        return v
+
 
 class Payload(BaseModel):
     source: str
@@ -40,104 +111,109 @@ class Payload(BaseModel):
     items: List[Item]
 
 
-def now_utc_iso() -> str:
-    return datetime.utcnow().isoformat() + "Z"
-
+# compiled once; validates/dumps a whole items list in one call (used for uploaded OM exports)
+ITEMS_ADAPTER = TypeAdapter(List[Item])
 
-def push_ingest(record: Dict[str, Any]) -> None:
-    INGESTS.insert(0, record)
-    if len(INGESTS) > MAX_INGESTS:
-        del INGESTS[MAX_INGESTS:]
 
+_last_ts = (-1, "")  # (epoch millisecond, formatted string); one tuple so threads never see a mixed pair
 
-def latest_items_flat() -> List[Dict[str, Any]]:
-    # flatten most recent ingest items
-    if not INGESTS:
-        return []
-    return INGESTS[0].get("items", [])
 
+def now_utc_iso() -> str:
+    # millisecond resolution; the formatted string is reused for calls within the same millisecond
+    global _last_ts
+    now_ms = time.time_ns() // 1_000_000
+    last_ms, last_str = _last_ts
+    if now_ms == last_ms:
+        return last_str
+    secs, ms = divmod(now_ms, 1000)
+    ts = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(secs)) + f".{ms:03d}Z"
+    _last_ts = (now_ms, ts)
+    return ts
+
+
+def render_row_html(record: IngestRecord) -> str:
+    # dashboard table cells (minus the "#" column), built once per ingest instead of per page view
+    return f"""
+                <td style="padding:10px;border-bottom:1px solid #333">{escape(record.received_at)}</td>
+                <td style="padding:10px;border-bottom:1px solid #333">{escape(record.platform)}</td>
+                <td style="padding:10px;border-bottom:1px solid #333">{escape(record.source)}</td>
+                <td style="padding:10px;border-bottom:1px solid #333">{record.count}</td>
+                <td style="padding:10px;border-bottom:1px solid #333;max-width:380px;overflow:hidden;text-overflow:ellipsis;white-space:nowrap;">
+                  {escape(record.page)}
+                </td>
+              </tr>
+            """
 
-def csv_from_items(items: List[Dict[str, Any]]) -> str:
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["platform", "dateISO", "url", "text"])
-    for it in items:
-        writer.writerow([
-            it.get("platform", ""),
-            it.get("dateISO", ""),
-            it.get("url", ""),
-            (it.get("text", "") or "").replace("\n", " ").strip()
-        ])
-    return output.getvalue()
 
+def push_ingest(record: IngestRecord, items: List[Dict[str, Any]]) -> None:
+    global LATEST_ITEMS
+    record.row_html = render_row_html(record)
+    # /manual runs in the threadpool, so pushes can race; publish summary and items as one step
+    with STORE_LOCK:
+        INGESTS.appendleft(record)  # deque maxlen drops the oldest
+        LATEST_ITEMS = items
 
-@app.get("/", response_class=HTMLResponse)
-def home():
-    service_time = now_utc_iso()
-    recent = INGESTS[:10]
 
-    rows_html = ""
-    if not recent:
-        rows_html = "<div style='opacity:.8'>No ingests received yet. Use OrangeMonkey “POST” to CR or upload a JSON payload below.</div>"
-    else:
-        rows = []
-        for i, r in enumerate(recent, start=1):
-            rows.append(f"""
-              <tr>
-                <td style="padding:10px;border-bottom:1px solid #333">{i}</td>
-                <td style="padding:10px;border-bottom:1px solid #333">{r.get("received_at","")}</td>
-                <td style="padding:10px;border-bottom:1px solid #333">{r.get("platform","")}</td>
-                <td style="padding:10px;border-bottom:1px solid #333">{r.get("source","")}</td>
-                <td style="padding:10px;border-bottom:1px solid #333">{r.get("count","")}</td>
-                <td style="padding:10px;border-bottom:1px solid #333;max-width:380px;overflow:hidden;text-overflow:ellipsis;white-space:nowrap;">
-                  {r.get("page","")}
-                </td>
-              </tr>
-            """)
+def latest_items_flat() -> List[Dict[str, Any]]:
+    # most recent ingest items
+    return LATEST_ITEMS
 
-        rows_html = f"""
-          <table style="width:100%;border-collapse:collapse;font-size:13px;">
-            <thead>
-              <tr style="text-align:left;opacity:.9">
-                <th style="padding:10px;border-bottom:1px solid #333">#</th>
-                <th style="padding:10px;border-bottom:1px solid #333">Received</th>
-                <th style="padding:10px;border-bottom:1px solid #333">Platform</th>
-                <th style="padding:10px;border-bottom:1px solid #333">Source</th>
-                <th style="padding:10px;border-bottom:1px solid #333">Count</th>
-                <th style="padding:10px;border-bottom:1px solid #333">Page</th>
-              </tr>
-            </thead>
-            <tbody>
-              {''.join(rows)}
-            </tbody>
-          </table>
-        """
 
-    html = f"""
-<!doctype html>
+def csv_chunks_from_items(items: List[Dict[str, Any]]) -> Iterator[str]:
+    # stream the CSV CSV_CHUNK_ROWS rows at a time, each batch joined from a preallocated list.
+    # Most rows need no quoting and are formatted directly; rows with a comma, quote or line break
+    # in any field fall back to csv.writer (one buffer/writer reused for the whole response).
+    output = io.StringIO()
+    writer = csv.writer(output)
+    yield "platform,dateISO,url,text\r\n"
+    for start in range(0, len(items), CSV_CHUNK_ROWS):
+        batch = items[start:start + CSV_CHUNK_ROWS]
+        parts = [""] * len(batch)
+        for j, it in enumerate(batch):
+            row = (
+                it.get("platform") or "",
+                it.get("dateISO") or "",
+                it.get("url") or "",
+                (it.get("text") or "").replace("\n", " ").strip()
+            )
+            line = "%s,%s,%s,%s\r\n" % row
+            if line.count(",") == 3 and line.count("\r") == 1 and line.count("\n") == 1 and '"' not in line:
+                parts[j] = line
+            else:
+                output.seek(0)
+                output.truncate()
+                writer.writerow(row)
+                parts[j] = output.getvalue()
+        yield "".join(parts)
+
+
+# -------- Dashboard page: static fragments built once at import, only the small dynamic parts per request --------
+_HEAD_HTML = """<!doctype html>
 <html>
 <head>
   <meta charset="utf-8"/>
   <meta name="viewport" content="width=device-width, initial-scale=1"/>
   <title>InsideSuccess Link Ingestor</title>
-  <style>
-    body {{
+"""
+
+_CSS = """  <style>
+    body {
       margin:0; padding:0;
       font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial;
       background:#0b0d10; color:#fff;
-    }}
-    .wrap {{ max-width: 920px; margin: 0 auto; padding: 28px 16px 60px; }}
-    .card {{
+    }
+    .wrap { max-width: 920px; margin: 0 auto; padding: 28px 16px 60px; }
+    .card {
       background: rgba(255,255,255,0.04);
       border: 1px solid rgba(255,255,255,0.08);
       border-radius: 14px;
       padding: 18px;
       margin-bottom: 14px;
       box-shadow: 0 14px 40px rgba(0,0,0,.25);
-    }}
-    .muted {{ opacity:.78; font-size:13px; }}
-    .title {{ font-weight:900; font-size:18px; margin-bottom:6px; }}
-    .btn {{
+    }
+    .muted { opacity:.78; font-size:13px; }
+    .title { font-weight:900; font-size:18px; margin-bottom:6px; }
+    .btn {
       display:inline-block;
       padding:10px 14px;
       border-radius:12px;
@@ -148,13 +224,13 @@ def home():
       font-weight:650;
       text-decoration:none;
       margin-right:8px;
-    }}
-    .btn.secondary {{
+    }
+    .btn.secondary {
       background: rgba(255,255,255,0.08);
       color:#fff;
       border:1px solid rgba(255,255,255,0.10);
-    }}
-    input, select, textarea {{
+    }
+    input, select, textarea {
       width:100%;
       background: rgba(0,0,0,0.35);
       color:#fff;
@@ -163,33 +239,34 @@ def home():
       padding: 10px;
       outline:none;
       box-sizing: border-box;
-    }}
-    textarea {{ min-height: 110px; resize: vertical; }}
-    label {{ font-size:12px; opacity:.8; display:block; margin-bottom:6px; }}
-    .grid2 {{ display:grid; grid-template-columns: 1fr 1fr; gap: 12px; }}
-    .note {{ color:#ffd37c; font-size:12px; opacity:.9; margin-top:8px; }}
+    }
+    textarea { min-height: 110px; resize: vertical; }
+    label { font-size:12px; opacity:.8; display:block; margin-bottom:6px; }
+    .grid2 { display:grid; grid-template-columns: 1fr 1fr; gap: 12px; }
+    .note { color:#ffd37c; font-size:12px; opacity:.9; margin-top:8px; }
   </style>
-</head>
+"""
+
+_PAGE_OPEN = _HEAD_HTML + _CSS + """</head>
 <body>
   <div class="wrap">
 
-    <div class="card">
-      <div class="title">InsideSuccess Link Ingestor</div>
-      <div class="muted">Service time (UTC): <b>{service_time}</b></div>
-      <div class="muted" style="margin-top:6px;">Stored ingests in this instance: <b>{len(INGESTS)}</b> (max {MAX_INGESTS}).</div>
-      <div class="note">Note: Cloud Run memory is not permanent. If you want persistence, next upgrade is Firestore/BigQuery.</div>
-    </div>
+"""
 
-    <div class="card">
+_RECENT_CARD_OPEN = """    <div class="card">
       <div class="title">Recent ingests</div>
-      {rows_html}
+      """
+
+_RECENT_CARD_CLOSE = """
       <div style="margin-top:14px;">
         <a class="btn" href="/download/latest.csv">Download latest CSV</a>
         <a class="btn secondary" href="/api/ingests">View /api/ingests</a>
       </div>
     </div>
 
-    <div class="card">
+"""
+
+_FORMS_HTML = """    <div class="card">
       <div class="title">Upload OM JSON payload</div>
       <form action="/upload" method="post" enctype="multipart/form-data">
         <input type="file" name="file" accept=".json,application/json" />
@@ -233,10 +310,69 @@ https://www.instagram.com/p/..."></textarea>
       </form>
     </div>
 
-  </div>
+"""
+
+_PAGE_CLOSE = """  </div>
 </body>
-</html>
-    """.strip()
+</html>"""
+
+_NO_INGESTS_HTML = "<div style='opacity:.8'>No ingests received yet. Use OrangeMonkey “POST” to CR or upload a JSON payload below.</div>"
+
+_TABLE_OPEN = """
+          <table style="width:100%;border-collapse:collapse;font-size:13px;">
+            <thead>
+              <tr style="text-align:left;opacity:.9">
+                <th style="padding:10px;border-bottom:1px solid #333">#</th>
+                <th style="padding:10px;border-bottom:1px solid #333">Received</th>
+                <th style="padding:10px;border-bottom:1px solid #333">Platform</th>
+                <th style="padding:10px;border-bottom:1px solid #333">Source</th>
+                <th style="padding:10px;border-bottom:1px solid #333">Count</th>
+                <th style="padding:10px;border-bottom:1px solid #333">Page</th>
+              </tr>
+            </thead>
+            <tbody>
+              """
+
+_TABLE_CLOSE = """
+            </tbody>
+          </table>
+        """
+
+
+@app.get("/", response_class=HTMLResponse)
+def home():
+    service_time = now_utc_iso()
+    recent = list(islice(INGESTS, 10))
+
+    if not recent:
+        rows_html = _NO_INGESTS_HTML
+    else:
+        rows = [
+            f"""
+              <tr>
+                <td style="padding:10px;border-bottom:1px solid #333">{i}</td>{r.row_html}"""
+            for i, r in enumerate(recent, start=1)
+        ]
+        rows_html = _TABLE_OPEN + "".join(rows) + _TABLE_CLOSE
+
+    status_card = f"""    <div class="card">
+      <div class="title">InsideSuccess Link Ingestor</div>
+      <div class="muted">Service time (UTC): <b>{service_time}</b></div>
+      <div class="muted" style="margin-top:6px;">Stored ingests in this instance: <b>{len(INGESTS)}</b> (max {MAX_INGESTS}).</div>
+      <div class="note">Note: Cloud Run memory is not permanent. If you want persistence, next upgrade is Firestore/BigQuery.</div>
+    </div>
+
+"""
+
+    html = "".join((
+        _PAGE_OPEN,
+        status_card,
+        _RECENT_CARD_OPEN,
+        rows_html,
+        _RECENT_CARD_CLOSE,
+        _FORMS_HTML,
+        _PAGE_CLOSE,
+    ))
 
     return HTMLResponse(content=html)
 
@@ -258,80 +394,111 @@ def ingest_help():
 
 @app.post("/ingest")
 async def ingest(payload: Payload, request: Request):
-    record = {
-        "received_at": now_utc_iso(),
-        "source": payload.source,
-        "page": payload.page,
-        "platform": payload.platform,
-        "startDate": payload.startDate,
-        "endDate": payload.endDate,
-        "count": len(payload.items),
-        "items": [it.model_dump() for it in payload.items],
-        "client": request.client.host if request.client else None,
-    }
-    push_ingest(record)
+    # one model_dump for the whole payload instead of one per item
+    dumped = payload.model_dump(mode="json")
+    items = dumped["items"]
+    record = IngestRecord(
+        received_at=now_utc_iso(),
+        source=dumped["source"],
+        page=dumped["page"],
+        platform=dumped["platform"],
+        startDate=dumped["startDate"],
+        endDate=dumped["endDate"],
+        count=len(items),
+        client=request.client.host if request.client else None,
+    )
+    push_ingest(record, items)
 
     # Cloud Run logs
     print({
         "event": "ingest",
-        "platform": payload.platform,
-        "count": len(payload.items),
-        "received_at": record["received_at"]
+        "platform": record.platform,
+        "count": len(items),
+        "received_at": record.received_at
     })
 
-    return {"status": "ok", "count": len(payload.items)}
+    return {"status": "ok", "count": len(items)}
 
 
 @app.get("/api/ingests")
-def api_ingests():
-    return {"count": len(INGESTS), "max": MAX_INGESTS, "ingests": INGESTS}
+def api_ingests(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=MAX_INGESTS),
+):
+    # snapshot in one C-level call first: a deque raises if push_ingest mutates it mid-iteration
+    snapshot = list(islice(INGESTS, offset, offset + limit))
+    ingests = [r.to_dict() for r in snapshot]
+    return {"count": len(INGESTS), "max": MAX_INGESTS, "offset": offset, "limit": limit, "ingests": ingests}
+
+
+def ndjson_from_ingests(records: List[IngestRecord]) -> Iterator[bytes]:
+    for r in records:
+        yield orjson.dumps(r.to_dict()) + b"\n"
+
+
+# full dump, one ingest per line, without building the whole JSON document in memory
+@app.get("/api/ingests/stream")
+def api_ingests_stream():
+    return StreamingResponse(ndjson_from_ingests(list(INGESTS)), media_type="application/x-ndjson")
 
 
 @app.get("/download/latest.csv")
 def download_latest_csv():
     items = latest_items_flat()
-    csv_text = csv_from_items(items)
-    return Response(
-        content=csv_text,
+    return StreamingResponse(
+        csv_chunks_from_items(items),
         media_type="text/csv",
         headers={"Content-Disposition": 'attachment; filename="latest.csv"'}
     )
 
 
+def load_upload(raw: bytes) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    # Accept OM export JSON format:
+    # { exportedAt, page, startDate, endDate, count, items: [...] }
+    # raises ValidationError for bad items, ValueError for anything that is not a JSON object
+    payload = orjson.loads(raw)
+    if not isinstance(payload, dict):
+        raise ValueError("upload must be a JSON object")
+    items = ITEMS_ADAPTER.dump_python(ITEMS_ADAPTER.validate_python(payload.get("items", [])), mode="json")
+    return payload, items
+
+
 @app.post("/upload")
 async def upload_json(file: UploadFile = File(...)):
     raw = await file.read()
     try:
-        payload = json.loads(raw.decode("utf-8"))
+        if len(raw) > UPLOAD_INLINE_PARSE_BYTES:
+            # keep big parses/validation off the event loop so /health and /ingest stay responsive
+            payload, items = await run_in_threadpool(load_upload, raw)
+        else:
+            payload, items = load_upload(raw)
+    except ValidationError:
+        return HTMLResponse("<h3>Invalid items in JSON file</h3><a href='/'>Back</a>", status_code=400)
     except Exception:
         return HTMLResponse("<h3>Invalid JSON file</h3><a href='/'>Back</a>", status_code=400)
 
-    # Accept OM export JSON format:
-    # { exportedAt, page, startDate, endDate, count, items: [...] }
-    items = payload.get("items", [])
     platform = payload.get("platform", payload.get("sourcePlatform", "unknown"))
     page = payload.get("page", "uploaded-file")
     startDate = payload.get("startDate", "")
     endDate = payload.get("endDate", "")
 
-    record = {
-        "received_at": now_utc_iso(),
-        "source": "upload",
-        "page": page,
-        "platform": platform if platform else "unknown",
-        "startDate": startDate,
-        "endDate": endDate,
-        "count": len(items),
-        "items": items,
-        "client": None,
-    }
-    push_ingest(record)
+    record = IngestRecord(
+        received_at=now_utc_iso(),
+        source="upload",
+        page=page,
+        platform=platform if platform else "unknown",
+        startDate=startDate,
+        endDate=endDate,
+        count=len(items),
+        client=None,
+    )
+    push_ingest(record, items)
 
     return HTMLResponse("<h3>Upload saved ✅</h3><a href='/'>Back to dashboard</a>")
 
 
 @app.post("/manual")
-async def manual_links(
+def manual_links(
     platform: str = Form(...),
     dateISO: str = Form(""),
     urls: str = Form(...)
@@ -339,17 +506,16 @@ async def manual_links(
     lines = [ln.strip() for ln in (urls or "").splitlines() if ln.strip()]
     items = [{"platform": platform, "dateISO": (dateISO or ""), "url": ln, "text": ""} for ln in lines]
 
-    record = {
-        "received_at": now_utc_iso(),
-        "source": "manual",
-        "page": "manual-input",
-        "platform": platform,
-        "startDate": "",
-        "endDate": "",
-        "count": len(items),
-        "items": items,
-        "client": None,
-    }
-    push_ingest(record)
+    record = IngestRecord(
+        received_at=now_utc_iso(),
+        source="manual",
+        page="manual-input",
+        platform=platform,
+        startDate="",
+        endDate="",
+        count=len(items),
+        client=None,
+    )
+    push_ingest(record, items)
 
     return HTMLResponse("<h3>Saved ✅</h3><a href='/'>Back to dashboard</a>")